@@ -1,11 +1,19 @@
+import numpy as np
 import pandas as pd
 import yfinance as yf
 from datetime import datetime, timedelta
 import smtplib
-from email.mime.text import MIMEText
+import atexit
+import logging
+import logging.handlers
+from email.message import EmailMessage
 import os
 import sys
+import time
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pytz
+from numba import njit
 
 # ================= CONFIG =================
 CSV_FILE = os.getenv("STOCKS_CSV_FILE", "stocks_layout.csv")
@@ -16,38 +24,127 @@ V20_MIN_MOVE = 20      # 20% upmove
 V20_PULLBACK_RANGE = 5 # Alert when price pulls back within 5% of pattern start
 V20_LOOKBACK_DAYS = 1095  # Check patterns from last 3 years (365 * 3)
 H45_DMA_DIFF = 14      # 14% below 200 DMA
+
+HISTORY_YEARS = 4      # One download covers V20 lookback and H45's 200 DMA
+PRICE_COLUMNS = ["Open", "Close"]  # All the strategies read; High/Low/Volume are dropped
+CACHE_DIR = os.getenv("STOCKS_CACHE_DIR", ".cache")  # Per-symbol parquet history
+CACHE_MAX_AGE = timedelta(hours=6)  # Reuse cached history this recent without asking Yahoo
+DOWNLOAD_THREADS = 8   # Concurrent Yahoo requests inside the batched download
+DOWNLOAD_BATCH_SIZE = 20  # Tickers per yf.download call
+DOWNLOAD_RETRIES = 2   # Extra attempts for tickers a batch returned no data for
+DOWNLOAD_PAUSE = 0.1   # Seconds between batches
+CACHE_IO_THREADS = 8   # Threads reading/writing per-symbol cache files
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "1"))  # Processes for V20 analysis (1 = in-process)
 # ==========================================
 
 
+# ---------------- LOGGING -----------------
+# Console output is buffered and written in one go at the end of run().
+# Warnings and errors flush straight away so they show up even if the run
+# dies early. V20 scan workers never log; they return their lines to run()
+log = logging.getLogger("scanner")
+log.setLevel(logging.INFO)
+log.propagate = False
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter("%(message)s"))
+_log_buffer = logging.handlers.MemoryHandler(
+    capacity=10000, flushLevel=logging.WARNING, target=_log_stream
+)
+log.addHandler(_log_buffer)
+
+
+# ------------- ALERT TEMPLATES ------------
+V20_ALERT_TEMPLATE = (
+    "🎯 V20 PATTERN #{number} ACTIVATED ({group})\n"
+    "Stock: {symbol}\n"
+    "Pattern Date: {start_date}\n"
+    "Support Level: ₹{start_price:.2f}\n"
+    "Peak Price: ₹{peak_price:.2f} (+{move:.2f}%)\n"
+    "Current Price: ₹{current:.2f}\n"
+    "Distance from Support: {diff_from_start:.2f}%\n"
+    "Pullback from Peak: {pullback_from_peak:.2f}%\n"
+    "📊 ACTION: Price near support level - potential buy opportunity"
+)
+
+H45_ALERT_TEMPLATE = (
+    "📉 H45 PATTERN ACTIVATED\n"
+    "Stock: {symbol}\n"
+    "Current Price: ₹{price:.2f}\n"
+    "200 DMA: ₹{dma:.2f}\n"
+    "Below DMA: {diff:.2f}%\n"
+    "📊 ACTION: Stock significantly below long-term average - potential buy"
+)
+
+
 # ---------------- EMAIL -------------------
-def send_email(subject, body):
-    """Send email alert. Returns True if successful, False otherwise."""
+_smtp = None  # Logged-in Gmail connection, reused across sends
+
+
+def _close_smtp(quit=True):
+    """
+    Close the shared SMTP connection, if one is open.
+    With quit=False the socket is dropped without waiting on a QUIT reply.
+    """
+    global _smtp
+    if _smtp is not None:
+        try:
+            if quit:
+                _smtp.quit()
+        except Exception:
+            pass
+        finally:
+            _smtp.close()  # quit() leaves the socket open if QUIT itself fails
+            _smtp = None
+
+
+def _smtp_connection(email_from, password):
+    """Return the shared SMTP connection, connecting and logging in on first use."""
+    global _smtp
+    if _smtp is None:
+        # Implicit TLS on 465 saves the STARTTLS round trip of port 587
+        _smtp = smtplib.SMTP_SSL("smtp.gmail.com", 465)
+        _smtp.login(email_from, password)
+    return _smtp
+
+
+atexit.register(_close_smtp)
+
+
+def send_emails(messages):
+    """
+    Send several (subject, body) emails over the shared connection.
+    Returns True if all were sent, False otherwise.
+    """
     email_from = os.getenv("EMAIL_FROM")
     email_to = os.getenv("EMAIL_TO")
     password = os.getenv("EMAIL_PASSWORD")
 
     if not email_from or not email_to or not password:
-        print("\n⚠️  Email credentials not configured")
-        print("Set EMAIL_FROM, EMAIL_TO, EMAIL_PASSWORD environment variables to enable email")
+        log.warning("\n⚠️  Email credentials not configured")
+        log.info("Set EMAIL_FROM, EMAIL_TO, EMAIL_PASSWORD environment variables to enable email")
         return False
 
     try:
-        msg = MIMEText(body)
-        msg["From"] = email_from
-        msg["To"] = email_to
-        msg["Subject"] = subject
-
-        server = smtplib.SMTP("smtp.gmail.com", 587)
-        server.starttls()
-        server.login(email_from, password)
-        server.send_message(msg)
-        server.quit()
+        server = _smtp_connection(email_from, password)
+        for subject, body in messages:
+            msg = EmailMessage()
+            msg["From"] = email_from
+            msg["To"] = email_to
+            msg["Subject"] = subject
+            msg.set_content(body)
+            server.send_message(msg)
         return True
     except Exception as e:
-        print(f"\n❌ Email send failed: {e}")
+        log.error(f"\n❌ Email send failed: {e}")
+        _close_smtp(quit=False)  # Don't reuse or wait on a connection in an unknown state
         return False
 
 
+def send_email(subject, body):
+    """Send email alert. Returns True if successful, False otherwise."""
+    return send_emails([(subject, body)])
+
+
 # ---------------- UTIL -------------------
 def clean_yf_df(df):
     """Flatten yfinance dataframe safely"""
@@ -57,181 +154,499 @@ def clean_yf_df(df):
     return df
 
 
+def price_arrays(df):
+    """
+    Unpack a cleaned history frame into plain ndarrays for the analyzers.
+    Returns (dates, opens, closes) with day-resolution datetime64[D] dates.
+
+    Prices are float32: ~7 significant digits is plenty for rupee prices
+    and halves the memory the V20 scan and DMA reductions stream through.
+    """
+    dates = pd.DatetimeIndex(df["Date"] if "Date" in df.columns else df.index)
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+
+    return (
+        dates.to_numpy().astype("datetime64[D]"),
+        df["Open"].to_numpy(dtype=np.float32),
+        df["Close"].to_numpy(dtype=np.float32),
+    )
+
+
+# ---------------- CACHE -------------------
+def cache_path(symbol):
+    """Parquet file holding a symbol's cached daily history."""
+    return os.path.join(CACHE_DIR, f"{symbol}.parquet")
+
+
+def read_cached_history(symbol, max_age=CACHE_MAX_AGE):
+    """
+    Load cached daily history for a symbol.
+    Returns (df, fresh) where fresh means the file is younger than
+    max_age, or (None, False) if there is no usable cache.
+    """
+    path = cache_path(symbol)
+    if not os.path.exists(path):
+        return None, False
+
+    try:
+        df = pd.read_parquet(path, columns=["Date", *PRICE_COLUMNS])
+    except Exception as e:
+        log.warning(f"  ⚠️  Ignoring unreadable cache for {symbol}: {e}")
+        return None, False
+
+    if df.empty:
+        return None, False
+
+    age = datetime.now() - datetime.fromtimestamp(os.path.getmtime(path))
+    return df, age < max_age
+
+
+def write_cached_history(symbol, df):
+    """Save daily history for a symbol as zstd-compressed parquet."""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(cache_path(symbol), compression="zstd", index=False)
+    except Exception as e:
+        log.warning(f"  ⚠️  Could not cache {symbol}: {e}")
+
+
+def merge_history(cached, recent):
+    """
+    Append newly downloaded bars to cached history.
+    The last cached bar may be a partial intraday bar from a run during
+    market hours, so it is always replaced by the downloaded one and the
+    bar before it is used as the overlap check instead.
+    Returns None when that bar disagrees (Yahoo re-adjusted prices for a
+    split/dividend), meaning the cache must be rebuilt.
+    """
+    check = -2 if len(cached) > 1 else -1
+    overlap = recent[recent["Date"] == cached["Date"].iloc[check]]
+    if not overlap.empty:
+        old_close = float(cached["Close"].iloc[check])
+        new_close = float(overlap["Close"].iloc[0])
+        if abs(new_close - old_close) > old_close * 0.001:
+            return None
+
+    df = pd.concat([cached, recent], ignore_index=True)
+    df = df.drop_duplicates(subset="Date", keep="last")
+
+    # Keep the cache at the same window a full download would return
+    cutoff = pd.Timestamp.now() - pd.DateOffset(years=HISTORY_YEARS)
+    return df[df["Date"] >= cutoff].reset_index(drop=True)
+
+
+# ---------------- DOWNLOAD ----------------
+def _download_batch(batch, **kwargs):
+    """
+    One yf.download call for a batch of tickers.
+    Returns {symbol: DataFrame} for the tickers that came back with data.
+    """
+    try:
+        data = yf.download(
+            batch,
+            interval="1d",
+            group_by="ticker",
+            threads=DOWNLOAD_THREADS,
+            auto_adjust=True,
+            progress=False,
+            **kwargs,
+        )
+    except Exception as e:
+        log.warning(f"  ⚠️  Download failed: {e}")
+        return {}
+
+    frames = {}
+    for s in batch:
+        try:
+            df = data[s][PRICE_COLUMNS].dropna()
+        except KeyError:
+            continue
+        if not df.empty:
+            frames[s] = clean_yf_df(df)
+
+    return frames
+
+
+def batch_download(symbols, **kwargs):
+    """
+    Download daily bars for all symbols with batched yf.download calls of
+    up to DOWNLOAD_BATCH_SIZE tickers each.
+    kwargs select the range (period=... or start=...).
+
+    yfinance reports per-ticker failures (rate limits included) as missing
+    data rather than raising. When most of a batch comes back empty, which
+    is what throttling looks like, the empty tickers are retried with
+    exponential backoff, up to DOWNLOAD_RETRIES times. A few empty tickers
+    among good data are unknown or delisted symbols and are not retried, so
+    a delisted ticker in the watchlist costs no extra wall time.
+    Returns {symbol: DataFrame}; symbols Yahoo returned no data for are left out.
+    """
+    frames = {}
+
+    for start in range(0, len(symbols), DOWNLOAD_BATCH_SIZE):
+        if start:
+            time.sleep(DOWNLOAD_PAUSE)  # Space out batches to stay under rate limits
+
+        pending = symbols[start:start + DOWNLOAD_BATCH_SIZE]
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            if attempt:
+                delay = 2 ** attempt
+                log.info(f"  ↻ Retrying {len(pending)} symbols in {delay}s (attempt {attempt + 1})...")
+                time.sleep(delay)
+
+            got = _download_batch(pending, **kwargs)
+            frames.update(got)
+            missing = [s for s in pending if s not in got]
+            if len(missing) < 2 or len(missing) * 2 <= len(pending):
+                break
+            pending = missing
+
+    return frames
+
+
+def download_history(symbols, max_age=CACHE_MAX_AGE):
+    """
+    Get daily history for all symbols, going through the parquet cache.
+    Cache files younger than max_age are used as-is, older ones are topped up with
+    only the bars since their last settled cached date, and anything else gets the
+    full history. Each step is one batched download. Cache files are read
+    and written from a thread pool since that part is pure file I/O.
+    Returns {symbol: DataFrame}; symbols Yahoo returned no data for are left out.
+    """
+    symbols = list(dict.fromkeys(symbols))  # Groups overlap; fetch each ticker once
+    if not symbols:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=CACHE_IO_THREADS) as pool:
+        cached = list(pool.map(partial(read_cached_history, max_age=max_age), symbols))
+
+    history = {}
+    stale = {}
+    updated = {}  # Symbols whose cache file needs rewriting
+    for s, (df, fresh) in zip(symbols, cached):
+        if df is None:
+            continue
+        if fresh:
+            history[s] = df
+        else:
+            stale[s] = df
+
+    log.info(f"\n💾 Cache: {len(history)} fresh, {len(stale)} stale, {len(symbols) - len(history) - len(stale)} missing")
+
+    if stale:
+        # Start from the oldest second-to-last cached bar so every stale
+        # symbol gets its possibly partial last bar replaced and a settled
+        # bar to check against
+        since = min(df["Date"].iloc[-2 if len(df) > 1 else -1] for df in stale.values())
+        log.info(f"⏬ Updating {len(stale)} symbols since {since.strftime('%Y-%m-%d')}...")
+        recent = batch_download(list(stale), start=since.strftime("%Y-%m-%d"))
+
+        for s, cached in stale.items():
+            if s not in recent:
+                history[s] = cached
+                continue
+
+            merged = merge_history(cached, recent[s])
+            if merged is None:
+                log.info(f"  ℹ️  {s}: cached prices differ from Yahoo's, refetching full history")
+                continue
+
+            history[s] = merged
+            updated[s] = merged
+
+    missing = [s for s in symbols if s not in history]
+    if missing:
+        log.info(f"⏬ Downloading {HISTORY_YEARS}y history for {len(missing)} symbols...")
+        for s, df in batch_download(missing, period=f"{HISTORY_YEARS}y").items():
+            history[s] = df
+            updated[s] = df
+
+    if updated:
+        with ThreadPoolExecutor(max_workers=CACHE_IO_THREADS) as pool:
+            list(pool.map(write_cached_history, updated.keys(), updated.values()))
+
+    log.info(f"✓ Got data for {len(history)}/{len(symbols)} symbols")
+    return history
+
+
 # ---------------- READ CSV ----------------
+@lru_cache(maxsize=1)
 def read_stocks():
-    """Read stock symbols from CSV file and validate format."""
+    """Read stock symbols from CSV file and validate format (parsed once per process)."""
     if not os.path.exists(CSV_FILE):
-        print(f"\n❌ ERROR: CSV file not found!")
-        print(f"   Looking for: {CSV_FILE}")
-        print(f"   Current directory: {os.getcwd()}")
-        print(f"\n   Files in current directory:")
+        log.error(f"\n❌ ERROR: CSV file not found!")
+        log.info(f"   Looking for: {CSV_FILE}")
+        log.info(f"   Current directory: {os.getcwd()}")
+        log.info(f"\n   Files in current directory:")
         for f in os.listdir('.'):
             if f.endswith('.csv') or f.endswith('.xlsx'):
-                print(f"   - {f}")
+                log.info(f"   - {f}")
         sys.exit(1)
     
-    print(f"✓ Reading stocks from: {CSV_FILE}")
+    log.info(f"✓ Reading stocks from: {CSV_FILE}")
     
     try:
         df = pd.read_csv(CSV_FILE)
     except Exception as e:
-        print(f"\n❌ Error reading CSV file: {e}")
+        log.error(f"\n❌ Error reading CSV file: {e}")
         sys.exit(1)
 
+    # Slice the three group columns out as one object array and filter each
+    # in a single pass. Symbols are interned: tickers shared between groups
+    # become one object, and dict lookups keyed by symbol compare by identity
+    columns = df.iloc[:, [0, 1, 2]].to_numpy(dtype=object)
     stocks = {
-        "V40": df.iloc[:, 0].dropna().tolist(),
-        "V40NEXT": df.iloc[:, 1].dropna().tolist(),
-        "H45": df.iloc[:, 2].dropna().tolist(),
-    }
-
-    for k in stocks:
-        stocks[k] = [
-            s.strip()
-            for s in stocks[k]
+        group: [
+            sys.intern(s.strip())
+            for s in columns[:, i]
             if isinstance(s, str) and s.endswith(".NS")
         ]
+        for i, group in enumerate(["V40", "V40NEXT", "H45"])
+    }
     
-    print(f"  - V40: {len(stocks['V40'])} stocks")
-    print(f"  - V40NEXT: {len(stocks['V40NEXT'])} stocks")
-    print(f"  - H45: {len(stocks['H45'])} stocks")
+    log.info(f"  - V40: {len(stocks['V40'])} stocks")
+    log.info(f"  - V40NEXT: {len(stocks['V40NEXT'])} stocks")
+    log.info(f"  - H45: {len(stocks['H45'])} stocks")
 
     return stocks
 
 
 # ------------- V20 PATTERN ----------------
-def find_v20_patterns(symbol):
+# V20 pattern rows: pattern start day, support (start open), peak close, % move
+V20_PATTERN_DTYPE = np.dtype([
+    ("start_date", "datetime64[D]"),
+    ("start_price", "f8"),
+    ("peak_price", "f8"),
+    ("move", "f8"),
+])
+
+
+@njit("int32[::1](int64[::1], int64[::1], float32[::1], float64)", cache=True, nogil=True)
+def _walk_v20_runs(candidates, end_idx, moves, min_move):
+    """
+    Hop from run to run through the candidate starts.
+    Returns positions (into candidates) of runs that moved min_move%+.
+
+    The explicit signature compiles (or loads from cache) at import rather
+    than on the first call, and nogil lets threads run it concurrently.
+    """
+    hits = np.empty(candidates.size, dtype=np.int32)
+    count = 0
+    k = 0
+
+    while k < candidates.size:
+        if moves[k] >= min_move:
+            hits[count] = k
+            count += 1
+
+        # Next start is the first candidate after this run
+        k = np.searchsorted(candidates, end_idx[k] + 1)
+
+    return hits[:count]
+
+
+# First whole day inside the lookback window, as a day-resolution datetime64
+# so the mask compares integer days against the date array without casting
+V20_CUTOFF_DAY = np.datetime64(datetime.now(), "D") - (V20_LOOKBACK_DAYS - 1)
+
+
+def find_v20_patterns(dates, opens, closes):
     """
     Find V20 patterns - strong upward moves of 20%+ that could indicate support levels.
-    Returns list of patterns from last 3 years (can be 1 or multiple patterns).
+    Returns patterns from last 3 years (can be 1 or multiple patterns) as a
+    V20_PATTERN_DTYPE structured array, one row per pattern.
+
+    A pattern starts on a green candle and runs up to 30 days, tolerating at
+    most 2 consecutive red candles; the peak is the highest green close in
+    that run. The per-start run end and peak are computed for every candidate
+    at once with NumPy, then _walk_v20_runs hops run-to-run in compiled code.
+    Does not catch errors; bad input (e.g. arrays not from price_arrays())
+    raises.
     """
-    try:
-        # Download longer history for pattern detection
-        df = yf.download(symbol, period="4y", progress=False)
-        if df.empty:
-            return []
+    n = closes.size
+    if n < 50:
+        return np.empty(0, dtype=V20_PATTERN_DTYPE)
+
+    idx = np.arange(n)
+
+    green = closes > opens
+    red = ~green
+
+    # Pattern starts: green candles inside the lookback window,
+    # leaving at least 5 days for a pattern
+    candidates = np.flatnonzero(green & (dates >= V20_CUTOFF_DAY) & (idx < n - 5))
+    if candidates.size == 0:
+        return np.empty(0, dtype=V20_PATTERN_DTYPE)
+
+    # The run from a start breaks at the 3rd consecutive red candle
+    red3 = np.zeros(n, dtype=bool)
+    red3[2:] = red[2:] & red[1:-1] & red[:-2]
+    next_red3 = np.minimum.accumulate(np.where(red3, idx, n)[::-1])[::-1]
+    last = np.minimum(
+        np.minimum(candidates + 29, n - 1),
+        next_red3[np.minimum(candidates + 1, n - 1)],
+    )
 
-        df = clean_yf_df(df)
+    # Run end = last green candle before the run breaks
+    prev_green = np.maximum.accumulate(np.where(green, idx, -1))
+    end_idx = np.maximum(prev_green[last], candidates + 1)
 
-        if len(df) < 50:
-            return []
+    # Peak = highest green close between the start and the run's last day.
+    # reduceat over interleaved (start, last + 1) bounds takes each
+    # segment's running max in one C loop; odd segments are discarded.
+    green_closes = np.full(n + 1, -np.inf, dtype=closes.dtype)
+    green_closes[:n] = np.where(green, closes, -np.inf)
+    bounds = np.column_stack([candidates, last + 1]).ravel()
+    highs = np.maximum.reduceat(green_closes, bounds)[::2]
 
-        # Calculate lookback cutoff date
-        cutoff_date = datetime.now() - timedelta(days=V20_LOOKBACK_DAYS)
+    start_prices = opens[candidates]
+    moves = ((highs - start_prices) / start_prices) * 100
 
-        patterns = []
-        i = 0
+    hits = _walk_v20_runs(candidates, end_idx, moves, float(V20_MIN_MOVE))
 
-        while i < len(df) - 5:  # Need at least 5 days for a pattern
-            open_p = float(df.iloc[i]["Open"])
-            close_p = float(df.iloc[i]["Close"])
+    patterns = np.empty(hits.size, dtype=V20_PATTERN_DTYPE)
+    patterns["start_date"] = dates[candidates[hits]]
+    patterns["start_price"] = np.round(start_prices[hits].astype(np.float64), 2)
+    patterns["peak_price"] = np.round(highs[hits].astype(np.float64), 2)
+    patterns["move"] = np.round(moves[hits].astype(np.float64), 2)
+    return patterns
 
-            # Must be green candle to start
-            if close_p <= open_p:
-                i += 1
-                continue
 
-            start_price = open_p
-            start_date = df.iloc[i]["Date"] if "Date" in df.columns else df.index[i]
-            
-            # Convert to datetime for comparison
-            if hasattr(start_date, 'date'):
-                pattern_date = start_date
-            else:
-                pattern_date = pd.to_datetime(start_date)
-            
-            # Skip old patterns
-            if pattern_date.replace(tzinfo=None) < cutoff_date:
-                i += 1
-                continue
-            
-            high = close_p
-            end_idx = i + 1
+def scan_v20_symbol(task):
+    """
+    Run the V20 check for one (symbol, group, price arrays) task.
+    Returns (lines, alerts): console lines to print and alert messages.
+    Lines are returned rather than printed so output stays in order when
+    this runs in a worker process.
+    """
+    s, group, arrays = task
+    lines = []
+    alerts = []
 
-            # Look for strong upward move (allow 1-2 red candles in between)
-            consecutive_red = 0
-            max_consecutive_red = 2
-            
-            for j in range(i + 1, min(i + 30, len(df))):  # Look up to 30 days ahead
-                o = float(df.iloc[j]["Open"])
-                c = float(df.iloc[j]["Close"])
-                
-                if c > o:  # Green candle
-                    high = max(high, c)
-                    consecutive_red = 0
-                    end_idx = j
-                else:  # Red candle
-                    consecutive_red += 1
-                    if consecutive_red > max_consecutive_red:
-                        break
-
-            move = ((high - start_price) / start_price) * 100
-
-            # Only keep patterns with 20%+ move
-            if move >= V20_MIN_MOVE:
-                patterns.append({
-                    "start_date": pattern_date.date() if hasattr(pattern_date, 'date') else pattern_date,
-                    "start_price": round(start_price, 2),
-                    "peak_price": round(high, 2),
-                    "move": round(move, 2),
-                })
-
-            i = end_idx + 1
-
-        return patterns
+    try:
+        if arrays is None:
+            lines.append(f"  ⚠️  {s}: No data available")
+            return lines, alerts
+
+        dates, opens, closes = arrays
+
+        # Current price is the last close of the same history
+        current = float(closes[-1])
+
+        # Patterns start at a candle's open, so if no open is anywhere near
+        # the current price none can be in alert range - skip the scan
+        if not (np.abs(opens - current) <= opens * ((V20_PULLBACK_RANGE + 1) / 100)).any():
+            return lines, alerts
+
+        # Find historical V20 patterns
+        try:
+            patterns = find_v20_patterns(dates, opens, closes)
+        except Exception as e:
+            lines.append(f"  ⚠️  Error processing {s}: {e}")
+            return lines, alerts
+        
+        if patterns.size == 0:
+            return lines, alerts
+
+        lines.append(f"  📈 {s}: Found {len(patterns)} V20 pattern(s)")
+        
+        alert_count = 0
+
+        # Check if current price has pulled back near any pattern's START price,
+        # for all patterns in one pass
+        start_prices = patterns["start_price"]
+        peak_prices = patterns["peak_price"]
+
+        # How far current price is from pattern start
+        diffs_from_start = ((current - start_prices) / start_prices) * 100
+
+        # How far current price has fallen from the peak
+        pullbacks_from_peak = ((peak_prices - current) / peak_prices) * 100
+
+        # Alert if:
+        # 1. Price is within V20_PULLBACK_RANGE% of the original start price (support level)
+        # 2. Price has pulled back at least 10% from peak (confirming it's a pullback scenario)
+        hits = (np.abs(diffs_from_start) <= V20_PULLBACK_RANGE) & (pullbacks_from_peak >= 10)
+
+        for idx in range(patterns.size):
+            diff_from_start = float(diffs_from_start[idx])
+            pullback_from_peak = float(pullbacks_from_peak[idx])
+
+            lines.append(f"    Pattern {idx+1}: Start=₹{start_prices[idx]:.2f}, Peak=₹{peak_prices[idx]:.2f} (+{patterns['move'][idx]:.2f}%), Current diff={diff_from_start:.2f}%, Pullback={pullback_from_peak:.2f}%")
+
+            if hits[idx]:
+                # Only alerting patterns are turned into Python objects
+                p = {name: patterns[name][idx].item() for name in V20_PATTERN_DTYPE.names}
+                alert_count += 1
+                alerts.append(V20_ALERT_TEMPLATE.format_map(dict(
+                    p,
+                    number=alert_count,
+                    group=group,
+                    symbol=s,
+                    current=current,
+                    diff_from_start=diff_from_start,
+                    pullback_from_peak=pullback_from_peak,
+                )))
+                lines.append(f"      ✅ ALERT! Price near support (within {V20_PULLBACK_RANGE}%)")
+        
+        if alert_count > 0:
+            lines.append(f"  ✓ {s} - {alert_count} V20 alert(s) generated!")
     
     except Exception as e:
-        print(f"  ⚠️  Error processing {symbol}: {e}")
-        return []
+        lines.append(f"  ⚠️  Error scanning {s}: {e}")
+
+    return lines, alerts
 
 
 # ------------- H45 LOGIC ------------------
-def check_h45(symbol):
+def h45_dmas(symbols, prices):
+    """
+    200 DMA for every symbol with at least 200 days of data.
+    The last 200 closes of all symbols are stacked into one
+    (symbols x 200) panel and averaged in a single reduction.
+    Returns {symbol: dma200}.
+    """
+    ready = [s for s in symbols if s in prices and prices[s][2].size >= 200]
+    if not ready:
+        return {}
+
+    panel = np.stack([prices[s][2][-200:] for s in ready])
+    return dict(zip(ready, panel.mean(axis=1).tolist()))
+
+
+def check_h45(symbol, closes, dma200):
     """
     Check if stock is 14%+ below 200 DMA (H45 pattern).
+    dma200 comes precomputed from h45_dmas().
     Returns (diff%, current_price, 200_dma) or None.
     
     Formula: If current price is BELOW 200 DMA by 14%+, it's a buy signal.
     diff = ((200_DMA - current_price) / 200_DMA) * 100
     """
     try:
-        df = yf.download(symbol, period="1y", progress=False)
-        if df.empty:
-            print(f"    ⚠️  {symbol}: No data available")
+        if closes is None:
+            log.warning(f"    ⚠️  {symbol}: No data available")
             return None
 
-        df = clean_yf_df(df)
-
-        if len(df) < 200:
-            print(f"    ⚠️  {symbol}: Insufficient data (need 200 days, got {len(df)})")
+        if closes.size < 200:
+            log.warning(f"    ⚠️  {symbol}: Insufficient data (need 200 days, got {closes.size})")
             return None
 
-        current = float(df["Close"].iloc[-1])
-        
-        # Calculate 200-day moving average
-        dma200_series = df["Close"].rolling(window=200).mean()
-        dma200 = float(dma200_series.iloc[-1])
-
-        # Check if DMA is valid
-        if pd.isna(dma200):
-            print(f"    ⚠️  {symbol}: 200 DMA calculation failed")
-            return None
+        current = float(closes[-1])
 
         # Calculate how far below the 200 DMA
         # Positive diff means stock is BELOW the DMA (good for H45)
         diff = ((dma200 - current) / dma200) * 100
 
         # Debug output for all H45 stocks
-        print(f"    📊 {symbol}: Price=₹{round(current, 2)}, 200DMA=₹{round(dma200, 2)}, Diff={round(diff, 2)}%", end="")
-        
-        if diff >= H45_DMA_DIFF:
-            print(f" ✅ ALERT!")
-            return round(diff, 2), round(current, 2), round(dma200, 2)
-        else:
-            print(f" (threshold: {H45_DMA_DIFF}%)")
-            return None
+        hit = diff >= H45_DMA_DIFF
+        status = "✅ ALERT!" if hit else f"(threshold: {H45_DMA_DIFF}%)"
+        log.info(f"    📊 {symbol}: Price=₹{current:.2f}, 200DMA=₹{dma200:.2f}, Diff={diff:.2f}% {status}")
+        return (diff, current, dma200) if hit else None
     
     except Exception as e:
-        print(f"    ❌ Error processing {symbol}: {e}")
+        log.error(f"    ❌ Error processing {symbol}: {e}")
         return None
 
 
@@ -239,141 +654,111 @@ def check_h45(symbol):
 def run(manual):
     """Main scanner logic."""
     now = datetime.now(IST)
+    today = now.strftime('%d %b %Y')
+    timestamp = now.strftime('%d %b %Y %H:%M:%S IST')
 
-    print(f"\n{'='*60}")
-    print(f"Stock Scanner - {now.strftime('%d %b %Y %H:%M:%S IST')}")
-    print(f"Run mode: {'Manual' if manual else 'Automatic'}")
-    print(f"{'='*60}\n")
+    log.info(f"\n{'='*60}")
+    log.info(f"Stock Scanner - {timestamp}")
+    log.info(f"Run mode: {'Manual' if manual else 'Automatic'}")
+    log.info(f"{'='*60}\n")
 
     stocks = read_stocks()
     alerts = []
 
+    # One batched download serves every group below
+    history = download_history(stocks["V40"] + stocks["V40NEXT"] + stocks["H45"])
+    prices = {s: price_arrays(df) for s, df in history.items()}
+
     # -------- V40 & V40 NEXT (V20 Pattern Detection)
-    print(f"\n{'='*60}")
-    print(f"Scanning V40 and V40NEXT stocks for V20 patterns...")
-    print(f"{'='*60}")
+    log.info(f"\n{'='*60}")
+    log.info(f"Scanning V40 and V40NEXT stocks for V20 patterns...")
+    log.info(f"{'='*60}")
     
+    # One task per unique symbol; a symbol listed in both groups is
+    # scanned once and labelled with both
+    groups_of = {}
     for group in ["V40", "V40NEXT"]:
         if not stocks[group]:
-            print(f"  ℹ️  No stocks in {group}")
+            log.info(f"  ℹ️  No stocks in {group}")
             continue
             
         for s in stocks[group]:
-            try:
-                # Find historical V20 patterns
-                patterns = find_v20_patterns(s)
-                
-                if not patterns:
-                    continue
-
-                print(f"  📈 {s}: Found {len(patterns)} V20 pattern(s)")
-
-                # Get current price
-                df = yf.download(s, period="5d", progress=False)
-                df = clean_yf_df(df)
-
-                if df.empty:
-                    print(f"    ⚠️  Cannot get current price")
-                    continue
-
-                current = float(df["Close"].iloc[-1])
-                
-                alert_count = 0
-
-                # Check if current price has pulled back near any pattern's START price
-                for idx, p in enumerate(patterns):
-                    # Calculate how far current price is from pattern start
-                    diff_from_start = ((current - p["start_price"]) / p["start_price"]) * 100
-                    
-                    # Calculate how far current price has fallen from the peak
-                    pullback_from_peak = ((p["peak_price"] - current) / p["peak_price"]) * 100
-
-                    print(f"    Pattern {idx+1}: Start=₹{p['start_price']}, Peak=₹{p['peak_price']} (+{p['move']}%), Current diff={round(diff_from_start, 2)}%, Pullback={round(pullback_from_peak, 2)}%")
-
-                    # Alert if:
-                    # 1. Price is within V20_PULLBACK_RANGE% of the original start price (support level)
-                    # 2. Price has pulled back at least 10% from peak (confirming it's a pullback scenario)
-                    if abs(diff_from_start) <= V20_PULLBACK_RANGE and pullback_from_peak >= 10:
-                        alert_count += 1
-                        alerts.append(
-                            f"🎯 V20 PATTERN #{alert_count} ACTIVATED ({group})\n"
-                            f"Stock: {s}\n"
-                            f"Pattern Date: {p['start_date']}\n"
-                            f"Support Level: ₹{p['start_price']}\n"
-                            f"Peak Price: ₹{p['peak_price']} (+{p['move']}%)\n"
-                            f"Current Price: ₹{round(current, 2)}\n"
-                            f"Distance from Support: {round(diff_from_start, 2)}%\n"
-                            f"Pullback from Peak: {round(pullback_from_peak, 2)}%\n"
-                            f"📊 ACTION: Price near support level - potential buy opportunity"
-                        )
-                        print(f"      ✅ ALERT! Price near support (within {V20_PULLBACK_RANGE}%)")
-                
-                if alert_count > 0:
-                    print(f"  ✓ {s} - {alert_count} V20 alert(s) generated!")
-            
-            except Exception as e:
-                print(f"  ⚠️  Error scanning {s}: {e}")
+            groups_of.setdefault(s, {})[group] = None
+
+    tasks = [(s, "/".join(groups), prices.get(s)) for s, groups in groups_of.items()]
+
+    if SCAN_WORKERS > 1:
+        # Forked workers inherit the log buffer; empty it first so nothing
+        # buffered so far can be written again from a worker
+        _log_buffer.flush()
+        with ProcessPoolExecutor(max_workers=SCAN_WORKERS) as ex:
+            results = list(ex.map(scan_v20_symbol, tasks, chunksize=4))
+    else:
+        results = map(scan_v20_symbol, tasks)
+
+    for lines, symbol_alerts in results:
+        for line in lines:
+            log.info(line)
+        alerts.extend(symbol_alerts)
 
     # -------- H45 (Below 200 DMA)
-    print(f"\n{'='*60}")
-    print(f"Scanning H45 stocks for 200 DMA patterns...")
-    print(f"{'='*60}")
+    log.info(f"\n{'='*60}")
+    log.info(f"Scanning H45 stocks for 200 DMA patterns...")
+    log.info(f"{'='*60}")
     
     if not stocks["H45"]:
-        print("  ℹ️  No stocks in H45 watchlist")
+        log.info("  ℹ️  No stocks in H45 watchlist")
+
+    dmas = h45_dmas(stocks["H45"], prices)
     
     for s in stocks["H45"]:
         try:
-            result = check_h45(s)
+            closes = prices[s][2] if s in prices else None
+            result = check_h45(s, closes, dmas.get(s))
             if result:
                 diff, price, dma = result
-                alerts.append(
-                    f"📉 H45 PATTERN ACTIVATED\n"
-                    f"Stock: {s}\n"
-                    f"Current Price: ₹{price}\n"
-                    f"200 DMA: ₹{dma}\n"
-                    f"Below DMA: {diff}%\n"
-                    f"📊 ACTION: Stock significantly below long-term average - potential buy"
-                )
-                print(f"  ✓ Alert generated for {s}")
+                alerts.append(H45_ALERT_TEMPLATE.format_map(
+                    {"symbol": s, "price": price, "dma": dma, "diff": diff}
+                ))
+                log.info(f"  ✓ Alert generated for {s}")
         
         except Exception as e:
-            print(f"  ⚠️  Error scanning {s}: {e}")
+            log.warning(f"  ⚠️  Error scanning {s}: {e}")
 
     # -------- Send Alerts
-    print(f"\n{'='*60}")
-    print(f"SCAN COMPLETE")
-    print(f"{'='*60}")
+    log.info(f"\n{'='*60}")
+    log.info(f"SCAN COMPLETE")
+    log.info(f"{'='*60}")
     
     if alerts:
-        subject = f"🚨 Stock Strategy Alerts – {len(alerts)} Opportunities – {now.strftime('%d %b %Y')}"
+        subject = f"🚨 Stock Strategy Alerts – {len(alerts)} Opportunities – {today}"
         body = f"Found {len(alerts)} trading opportunities:\n\n" + "\n\n".join(alerts)
         body += f"\n\n{'─'*60}\n"
-        body += f"Scan completed at {now.strftime('%d %b %Y %H:%M:%S IST')}\n"
+        body += f"Scan completed at {timestamp}\n"
         body += f"Next scan: Tomorrow same time\n"
         
-        print(f"\n📧 EMAIL REPORT")
-        print(f"{'-'*60}")
-        print(f"Subject: {subject}\n")
-        print(body)
-        print(f"{'-'*60}\n")
+        log.info(f"\n📧 EMAIL REPORT")
+        log.info(f"{'-'*60}")
+        log.info(f"Subject: {subject}\n")
+        log.info(body)
+        log.info(f"{'-'*60}\n")
         
         email_sent = send_email(subject, body)
         if email_sent:
-            print(f"✅ Email sent successfully with {len(alerts)} alerts")
+            log.info(f"✅ Email sent successfully with {len(alerts)} alerts")
         else:
-            print(f"⚠️  {len(alerts)} alerts found but email not sent")
-            print(f"   Configure EMAIL_FROM, EMAIL_TO, EMAIL_PASSWORD to enable email")
+            log.warning(f"⚠️  {len(alerts)} alerts found but email not sent")
+            log.info(f"   Configure EMAIL_FROM, EMAIL_TO, EMAIL_PASSWORD to enable email")
     else:
-        print("\n❌ No alerts today")
-        print("   All stocks are outside the strategy thresholds")
+        log.info("\n❌ No alerts today")
+        log.info("   All stocks are outside the strategy thresholds")
         
         # Optional: Send a daily "no alerts" summary email
         # Uncomment below if you want daily confirmation emails even when no alerts
         """
         if not manual:
-            subject = f"📊 Daily Stock Scan – No Alerts – {now.strftime('%d %b %Y')}"
-            body = f"Daily scan completed at {now.strftime('%d %b %Y %H:%M:%S IST')}\n\n"
+            subject = f"📊 Daily Stock Scan – No Alerts – {today}"
+            body = f"Daily scan completed at {timestamp}\n\n"
             body += f"Stocks scanned:\n"
             body += f"  • V40: {len(stocks['V40'])} stocks\n"
             body += f"  • V40NEXT: {len(stocks['V40NEXT'])} stocks\n"
@@ -383,6 +768,8 @@ def run(manual):
             send_email(subject, body)
         """
 
+    _log_buffer.flush()
+
 
 # --------------- ENTRY --------------------
 if __name__ == "__main__":
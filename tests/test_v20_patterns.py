@@ -0,0 +1,97 @@
+"""
+Check the vectorized V20 scan against a plain loop with the original
+semantics: a pattern starts on a green candle inside the lookback, runs up
+to 30 days, breaks on the 3rd consecutive red candle, ends on its last
+green candle, and the next search resumes the day after that.
+
+Run from the repo root: python -m unittest discover tests
+"""
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import scanner
+
+
+def reference_v20_patterns(df):
+    """Straight port of the original per-row loop over a Date/Open/Close frame."""
+    opens = [float(x) for x in df["Open"]]
+    closes = [float(x) for x in df["Close"]]
+    dates = list(df["Date"])
+    cutoff_date = datetime.now() - timedelta(days=scanner.V20_LOOKBACK_DAYS)
+
+    if len(df) < 50:
+        return []
+
+    patterns = []
+    i = 0
+    while i < len(df) - 5:
+        if closes[i] <= opens[i] or dates[i] < cutoff_date:
+            i += 1
+            continue
+
+        start_price = opens[i]
+        high = closes[i]
+        end_idx = i + 1
+        consecutive_red = 0
+        for j in range(i + 1, min(i + 30, len(df))):
+            if closes[j] > opens[j]:
+                high = max(high, closes[j])
+                consecutive_red = 0
+                end_idx = j
+            else:
+                consecutive_red += 1
+                if consecutive_red > 2:
+                    break
+
+        move = ((high - start_price) / start_price) * 100
+        if move >= scanner.V20_MIN_MOVE:
+            patterns.append((dates[i].date(), round(start_price, 2), round(high, 2), round(move, 2)))
+
+        i = end_idx + 1
+
+    return patterns
+
+
+def random_history(seed, days=1000):
+    """Daily bars ending today with runs of green/red candles and 20%+ moves."""
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0.002, 0.03, days)))
+    opens = closes * np.exp(rng.normal(0, 0.02, days))
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=days, freq="B")
+    df = pd.DataFrame({"Date": dates, "Open": opens.round(2), "Close": closes.round(2)})
+    # Compare on the float32 prices the scanner actually sees
+    df[["Open", "Close"]] = df[["Open", "Close"]].astype(np.float32)
+    return df
+
+
+class V20PatternTest(unittest.TestCase):
+
+    def test_matches_reference_loop(self):
+        total = 0
+        for seed in range(300):
+            df = random_history(seed)
+            expected = reference_v20_patterns(df)
+            got = scanner.find_v20_patterns(*scanner.price_arrays(df))
+
+            with self.subTest(seed=seed):
+                self.assertEqual(len(got), len(expected))
+                for row, (start_date, start_price, peak_price, move) in zip(got, expected):
+                    self.assertEqual(row["start_date"].item(), start_date)
+                    # float32 arithmetic can move the last rounded digit
+                    self.assertAlmostEqual(row["start_price"], start_price, delta=0.011)
+                    self.assertAlmostEqual(row["peak_price"], peak_price, delta=0.011)
+                    self.assertAlmostEqual(row["move"], move, delta=0.011)
+            total += len(expected)
+
+        self.assertGreater(total, 100)  # The histories actually exercise the scan
+
+    def test_short_history_has_no_patterns(self):
+        df = random_history(0, days=40)
+        self.assertEqual(scanner.find_v20_patterns(*scanner.price_arrays(df)).size, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()